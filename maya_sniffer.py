@@ -1,4 +1,5 @@
 import os
+import re
 import time
 import argparse
 import functools
@@ -8,6 +9,22 @@ import shiboken2
 
 maya_window = None
 dpi = None
+scaled_stylesheet = None
+
+# Print how long slow steps take, e.g. MAYA_SNIFFER_TIMING=1
+timing = bool(os.environ.get("MAYA_SNIFFER_TIMING"))
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    # Backwards compatibility with Python 2.x
+    clock = time.time
+
+try:
+    # Backwards compatibility with Python 2.x
+    long
+except NameError:
+    long = int
 
 color_template = """\
 Square[nodeType=%(nodeType)s] { background: %(color)s; }
@@ -35,16 +52,6 @@ colors = {
     "animCurveUU": "#D474EC",
 }
 
-colors = "\n".join(
-    color_template % {
-        "nodeType": node_type,
-        "color": color,
-        "hover": QtGui.QColor(color).lighter(110).name(),
-        "focus": QtGui.QColor(color).lighter(150).name(),
-    }
-    for node_type, color in colors.items()
-)
-
 stylesheet = """
 QSpinBox {
     min-width: 50px;
@@ -61,20 +68,23 @@ Square {
 }
 Square:hover { background: #aaa; }
 
-""" + colors
+"""
 
 
 def timer(func):
+    if not timing:
+        return func
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         name = func.__name__
-        start = time.time()
+        start = clock()
 
         try:
             return func(*args, **kwargs)
 
         finally:
-            end = time.time()
+            end = clock()
             duration = end - start
 
             if duration > 0.1:
@@ -102,6 +112,41 @@ def scale_stylesheet(style):
     return "\n".join(output)
 
 
+def build_stylesheet():
+    """Return the stylesheet with node colors, scaled to the current DPI
+
+    Neither colors nor DPI change during the lifetime of this Python
+    session, so this is only computed once, on first use.
+
+    """
+
+    global scaled_stylesheet
+
+    if not scaled_stylesheet:
+        # Many node types share a color, e.g. each kind of animCurve
+        shades = {}
+        for color in set(colors.values()):
+            qcolor = QtGui.QColor(color)
+            shades[color] = {
+                "hover": qcolor.lighter(110).name(),
+                "focus": qcolor.lighter(150).name(),
+            }
+
+        node_colors = "\n".join(
+            color_template % {
+                "nodeType": node_type,
+                "color": color,
+                "hover": shades[color]["hover"],
+                "focus": shades[color]["focus"],
+            }
+            for node_type, color in colors.items()
+        )
+
+        scaled_stylesheet = scale_stylesheet(stylesheet + node_colors)
+
+    return scaled_stylesheet
+
+
 def px(value):
     """Return a scaled value, for HDPI resolutions"""
 
@@ -138,12 +183,6 @@ def MayaWindow():
         from maya.OpenMayaUI import MQtUtil
         ptr = MQtUtil.mainWindow()
 
-        try:
-            # Backwards compatibility with Python 2.x
-            long
-        except NameError:
-            long = int
-
         if ptr is not None:
             maya_window = shiboken2.wrapInstance(
                 long(ptr), QtWidgets.QMainWindow
@@ -156,74 +195,155 @@ def MayaWindow():
     return maya_window
 
 
+# Commands of interest to the parser, at the start of a line
+record_pattern = re.compile(br"\n(createNode|connectAttr|select)")
+
+
 class Parser(object):
     def __init__(self):
         self._current_node = None
         self._current_node_type = None
 
+        # Counters of the current node, such that its
+        # attribute edits needn't look it up by name
+        self._current_entry = None
+
         self.result = {}
 
     def on_create(self, line):
-        comp = line.split()
-        index = comp.index("-n")
-        node_type = comp[1]
-        name = comp[index + 1]
-        name = name.replace('"', "")
+        # E.g. createNode mesh -n "pCubeShape1" -p "pCube1"
+        head, _, tail = line.partition(b" -n ")
+        node_type = head.split(None, 2)[1].decode("ascii", "replace")
+        name = tail.split(None, 1)[0].strip(b'"').decode("ascii", "replace")
 
-        self._current_node = name
-        self._current_node_type = node_type
+        self.on_finish()
 
-    def on_setattr(self, line):
         nodes = self.result["nodes"]
+        entry = nodes.get(name)
 
-        if self._current_node not in nodes:
-            nodes[self._current_node] = {
-                "nodeType": self._current_node_type,
+        # Names aren't unique, e.g. shapes under different parents
+        if entry is None:
+            entry = nodes[name] = {
+                "nodeType": node_type,
                 "lines": 0,
                 "characters": 0,
             }
 
-        nodes[self._current_node]["lines"] += 1
-        nodes[self._current_node]["characters"] += len(line)
+        self._current_node = name
+        self._current_node_type = node_type
+        self._current_entry = entry
 
-    @timer
-    def read(self, fname):
-        with open(fname) as f:
-            return f.readlines()
+    def on_setattr(self, body):
+        """Count `body`, the attribute edits following a createNode"""
+        entry = self._current_entry
+        entry["lines"] += body.count(b"\n")
+        entry["characters"] += len(body)
+
+        # The last line of a file needn't end with a newline
+        if body and not body.endswith(b"\n"):
+            entry["lines"] += 1
+
+    def on_finish(self):
+        """Forget about the current node, if it had nothing to it"""
+        entry = self._current_entry
+
+        if entry is not None and not entry["lines"]:
+            del self.result["nodes"][self._current_node]
+
+        self._current_entry = None
 
     @timer
     def parse(self, fname):
-        lines = self.read(fname)
-
         self.result = {
             "fname": fname,
             "filesize": os.path.getsize(fname),
-            "lineCount": len(lines),
-            "totalCharacterCount": sum([len(line) for line in lines]),
+            "lineCount": 0,
+            "totalCharacterCount": 0,
             "nodes": {},
         }
 
-        for line in lines:
-            # Once node creation completes, Maya
-            # selects and modifies the time1 node
-            if line.startswith("select"):
-                break
+        self._current_node = None
+        self._current_node_type = None
+        self._current_entry = None
 
-            # In case it doesn't, then connections are next
-            if line.startswith("connectAttr"):
-                break
+        line_count = 0
+        character_count = 0
+        last = b""
+        pending = []
+        parsing = True
+
+        # Read in chunks rather than lines, such that each is scanned
+        # in one go and memory use doesn't grow with the size of the
+        # scene, which can be several hundred megabytes.
+        with open(fname, "rb") as f:
+            for data in iter(functools.partial(f.read, 1 << 20), b""):
+                line_count += data.count(b"\n")
+                character_count += len(data)
+                last = data[-1:]
+
+                if not parsing:
+                    continue
+
+                # Only whole lines are scanned, the remainder is carried
+                # over to the next chunk. Each starts with the newline
+                # ending the line before it, see scan()
+                pending.append(data)
+
+                if b"\n" not in data:
+                    continue
+
+                chunk = b"".join([b"\n"] + pending)
+                cut = chunk.rfind(b"\n") + 1
+                pending = [chunk[cut:]]
+                parsing = self.scan(chunk[:cut])
+
+        if parsing:
+            self.scan(b"".join([b"\n"] + pending))
+
+        self.on_finish()
+
+        # The last line of a file needn't end with a newline
+        if last and last != b"\n":
+            line_count += 1
 
-            # Remove padding and newline
-            line = line.strip().rstrip(" ;\n")
+        self.result["lineCount"] = line_count
+        self.result["totalCharacterCount"] = character_count
 
-            if line.startswith("createNode"):
-                self.on_create(line)
+    def scan(self, buf):
+        """Parse each node from whole lines of a scene
 
-            elif line.startswith("setAttr"):
-                self.on_setattr(line)
+        Maya writes each command at the start of a line, with attribute
+        edits (setAttr, addAttr, rename, ...) indented below the createNode
+        they belong to. So everything in between two createNode lines is
+        counted towards the first, without looking at individual lines.
 
-            elif self._current_node is not None:
-                self.on_setattr(line)
+        `buf` starts with the newline ending the line before it, which
+        isn't counted again. Returns False once past the last node.
+
+        """
+
+        body = 1 if self._current_entry is not None else None
+
+        for match in record_pattern.finditer(buf):
+            start = match.start(1)
+
+            if body is not None:
+                self.on_setattr(buf[body:start])
+                body = None
+
+            # Once node creation completes, Maya selects and modifies
+            # the time1 node. In case it doesn't, connections are next.
+            if match.group(1) != b"createNode":
+                return False
+
+            eol = buf.find(b"\n", start)
+            body = len(buf) if eol < 0 else eol + 1
+            self.on_create(buf[start:body].strip().rstrip(b" ;"))
+
+        if body is not None:
+            self.on_setattr(buf[body:])
+
+        return True
 
 
 class Square(QtWidgets.QLabel):
@@ -295,16 +415,26 @@ class Widget(QtWidgets.QDialog):
         self._panels = panels
         self._widgets = widgets
 
+        items = sorted(
+            data["nodes"].items(),
+            reverse=True,
+            key=lambda i: i[1]["characters"]
+        )
+
         self._data = {
             "parsed": data,
-            "items": sorted(
-                data["nodes"].items(),
-                reverse=True,
-                key=lambda i: i[1]["characters"]
-            )
+            "items": items,
+            "keys": [i[0] for i in items],
+            "characterCounts": [i[1]["characters"] for i in items],
         }
 
-        self.setStyleSheet(scale_stylesheet(stylesheet))
+        # Rectangles of the latest layout, keyed by (peak, width, height)
+        self._layout_cache = {}
+
+        # Squares are reused between layouts, rather than recreated
+        self._square_pool = []
+
+        self.setStyleSheet(build_stylesheet())
 
     def mousePressEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
@@ -326,6 +456,8 @@ class Widget(QtWidgets.QDialog):
         for child in self._panels["body"].children():
             child.deleteLater()
 
+        self._square_pool = []
+
     def showEvent(self, event):
         self._timer.start()
 
@@ -334,8 +466,6 @@ class Widget(QtWidgets.QDialog):
 
     @timer
     def layout(self):
-        self.clear()
-
         body = self._panels["body"]
         size = body.size()
         items = self._data["items"]
@@ -349,39 +479,74 @@ class Widget(QtWidgets.QDialog):
         maxcount = self._widgets["maxCount"].value()
         peak = max([1, min(maxcount, len(items))])
 
-        keys = list(
-            i[0] for i in items[:peak]
-        )
+        keys = self._data["keys"][:peak]
+        character_counts = self._data["characterCounts"][:peak]
 
-        character_counts = list(
-            i[1]["characters"] for i in items[:peak]
-        )
+        # Show and resize events often ask for the same layout twice
+        cache_key = (peak, width, height)
+        rects = self._layout_cache.get(cache_key)
+
+        if rects is None:
+            sizes = normalize_sizes(character_counts, width, height)
+            rects = squarify(sizes, x, y, width, height)
 
-        sizes = normalize_sizes(character_counts, width, height)
-        padded_rects = squarify(sizes, x, y, width, height)
-
-        for index, rect in enumerate(padded_rects):
-            name = keys[index]
-            characters = character_counts[index]
-            characters = float(characters)  # Support division
-            typ = parsed["nodes"][name]["nodeType"]
-
-            # Give names to the first n-number of items
-            if rect["dx"] > px(80):
-                percentage = (characters / parsed["totalCharacterCount"]) * 100
-                label = "%s\n%.1f%% (%d)" % (name, percentage, characters)
-            else:
-                label = "%d" % characters
-
-            button = Square(label, parent=body)
-            button.setObjectName(name)
-            button.setAlignment(QtCore.Qt.AlignCenter)
-            button.setProperty("node", True)
-            button.setProperty("nodeType", typ)
-            button.setToolTip("%s (%d)\n%s" % (name, characters, typ))
-            button.move(rect["x"], rect["y"])
-            button.setFixedSize(rect["dx"], rect["dy"])
-            button.show()
+            # Only the latest is of interest, as resizing
+            # would otherwise fill this up with every size
+            self._layout_cache = {cache_key: rects}
+
+        xs, ys, dxs, dys = rects
+
+        # Repaint once all squares are in place, rather than per square
+        body.setUpdatesEnabled(False)
+
+        try:
+            pool = self._square_pool
+            label_width = px(80)
+            total_characters = parsed["totalCharacterCount"]
+
+            while len(pool) < peak:
+                button = Square(parent=body)
+                button.setAlignment(QtCore.Qt.AlignCenter)
+                button.setProperty("node", True)
+                pool.append(button)
+
+            for index in range(peak):
+                name = keys[index]
+                characters = character_counts[index]
+                characters = float(characters)  # Support division
+                typ = parsed["nodes"][name]["nodeType"]
+
+                # Give names to the first n-number of items
+                if dxs[index] > label_width:
+                    percentage = (characters / total_characters) * 100
+                    label = "%s\n%.1f%% (%d)" % (name, percentage, characters)
+                else:
+                    label = "%d" % characters
+
+                button = pool[index]
+
+                if button.objectName() != name:
+                    button.setObjectName(name)
+                    button.setToolTip("%s (%d)\n%s" % (name, characters, typ))
+
+                if button.property("nodeType") != typ:
+                    button.setProperty("nodeType", typ)
+
+                    # Stylesheet selectors are only evaluated on polish
+                    style = button.style()
+                    style.unpolish(button)
+                    style.polish(button)
+
+                button.setText(label)
+                button.move(int(xs[index]), int(ys[index]))
+                button.setFixedSize(int(dxs[index]), int(dys[index]))
+                button.show()
+
+            for button in pool[peak:]:
+                button.hide()
+
+        finally:
+            body.setUpdatesEnabled(True)
 
 
 def parse(fname=None):
@@ -446,111 +611,121 @@ def show():
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
-def pad_rectangle(rect):
-    if rect["dx"] > 2:
-        rect["x"] += 1
-        rect["dx"] -= 2
-    if rect["dy"] > 2:
-        rect["y"] += 1
-        rect["dy"] -= 2
-
-
-def layoutrow(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    width = covered_area / dy
-    rects = []
-    for size in sizes:
-        rects.append({"x": x, "y": y, "dx": width, "dy": size / width})
-        y += size / width
-    return rects
-
-
-def layoutcol(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    height = covered_area / dx
-    rects = []
-    for size in sizes:
-        rects.append({"x": x, "y": y, "dx": size / height, "dy": height})
-        x += size / height
-    return rects
-
-
-def layout(sizes, x, y, dx, dy):
-    return (
-        layoutrow(sizes, x, y, dx, dy)
-        if dx >= dy
-        else layoutcol(sizes, x, y, dx, dy)
-    )
-
-
-def leftoverrow(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    width = covered_area / dy
-    leftover_x = x + width
-    leftover_y = y
-    leftover_dx = dx - width
-    leftover_dy = dy
-    return (leftover_x, leftover_y, leftover_dx, leftover_dy)
-
+def pad_rectangles(xs, ys, dxs, dys):
+    for index in range(len(xs)):
+        if dxs[index] > 2:
+            xs[index] += 1
+            dxs[index] -= 2
+        if dys[index] > 2:
+            ys[index] += 1
+            dys[index] -= 2
 
-def leftovercol(sizes, x, y, dx, dy):
-    covered_area = sum(sizes)
-    height = covered_area / dx
-    leftover_x = x
-    leftover_y = y + height
-    leftover_dx = dx
-    leftover_dy = dy - height
-    return (leftover_x, leftover_y, leftover_dx, leftover_dy)
 
+def worst_ratio(covered_area, smallest, largest, side):
+    """Worst aspect ratio of a row laid out along `side`
 
-def leftover(sizes, x, y, dx, dy):
-    return (
-        leftoverrow(sizes, x, y, dx, dy)
-        if dx >= dy
-        else leftovercol(sizes, x, y, dx, dy)
-    )
+    Only the total, smallest and largest size of a row matter,
+    such that a row can be grown one size at a time without
+    laying it out. See Bruls et al., "Squarified Treemaps"
 
+    """
 
-def worst_ratio(sizes, x, y, dx, dy):
+    side = side * side
+    covered_area = covered_area * covered_area
     return max(
-        [
-            max(rect["dx"] / rect["dy"], rect["dy"] / rect["dx"])
-            for rect in layout(sizes, x, y, dx, dy)
-        ]
+        side * largest / covered_area,
+        covered_area / (side * smallest),
     )
 
 
 def squarify(sizes, x, y, dx, dy):
-    sizes = list(map(float, sizes))
+    """Lay out `sizes` as rectangles within x, y, dx and dy
 
-    if len(sizes) == 0:
-        return []
+    Returns:
+        (xs, ys, dxs, dys): One list per dimension, in the
+            order of `sizes`, rather than one object per rectangle
 
-    if len(sizes) == 1:
-        return layout(sizes, x, y, dx, dy)
+    """
 
-    # figure out where 'split' should be
-    i = 1
-    while (i < len(sizes) and
-           worst_ratio(sizes[:i], x, y, dx, dy) >=
-           worst_ratio(sizes[: (i + 1)], x, y, dx, dy)):
-        i += 1
+    sizes = list(map(float, sizes))
+    count = len(sizes)
+    xs = [0.0] * count
+    ys = [0.0] * count
+    dxs = [0.0] * count
+    dys = [0.0] * count
+
+    # Rows are laid out one after the other, each taking the next
+    # range of sizes and leaving what's left over for the next
+    lo = 0
+    while lo < count:
+        side = min(dx, dy)
+        side_squared = side * side
+
+        # figure out where 'split' should be
+        covered_area = smallest = largest = sizes[lo]
+        ratio = worst_ratio(covered_area, smallest, largest, side)
+
+        # This is where most of the time is spent, so rather than
+        # calling worst_ratio() per size, it is inlined here
+        hi = lo + 1
+        while hi < count:
+            size = sizes[hi]
+            next_area = covered_area + size
+            next_area_squared = next_area * next_area
+            next_smallest = size if size < smallest else smallest
+            next_largest = size if size > largest else largest
+
+            next_ratio = side_squared * next_largest / next_area_squared
+            inverse_ratio = next_area_squared / (side_squared * next_smallest)
+
+            if inverse_ratio > next_ratio:
+                next_ratio = inverse_ratio
+
+            if ratio < next_ratio:
+                break
 
-    current = sizes[:i]
-    remaining = sizes[i:]
+            covered_area = next_area
+            smallest = next_smallest
+            largest = next_largest
+            ratio = next_ratio
+            hi += 1
+
+        if dx >= dy:
+            width = covered_area / dy
+            offset = y
+            for index in range(lo, hi):
+                height = sizes[index] / width
+                xs[index] = x
+                ys[index] = offset
+                dxs[index] = width
+                dys[index] = height
+                offset += height
+
+            x += width
+            dx -= width
 
-    leftover_x, leftover_y, leftover_dx, leftover_dy = leftover(
-        current, x, y, dx, dy)
+        else:
+            height = covered_area / dx
+            offset = x
+            for index in range(lo, hi):
+                width = sizes[index] / height
+                xs[index] = offset
+                ys[index] = y
+                dxs[index] = width
+                dys[index] = height
+                offset += width
 
-    return layout(current, x, y, dx, dy) + squarify(
-        remaining, leftover_x, leftover_y, leftover_dx, leftover_dy
-    )
+            y += height
+            dy -= height
+
+        lo = hi
+
+    return xs, ys, dxs, dys
 
 
 def padded_squarify(sizes, x, y, dx, dy):
     rects = squarify(sizes, x, y, dx, dy)
-    for rect in rects:
-        pad_rectangle(rect)
+    pad_rectangles(*rects)
     return rects
 
 
@@ -565,16 +740,12 @@ def normalize_sizes(sizes, dx, dy, minimum_size=0.01):
     """
 
     minsize = max(sizes) * minimum_size
-
-    for index, size in enumerate(sizes):
-        sizes[index] = max([size, minsize])
+    sizes = [float(size if size > minsize else minsize) for size in sizes]
 
     total_size = sum(sizes)
     total_area = dx * dy
-    sizes = map(float, sizes)
-    sizes = map(lambda size: size * total_area / total_size, sizes)
 
-    return list(sizes)
+    return [size * total_area / total_size for size in sizes]
 
 
 if __name__ == '__main__':